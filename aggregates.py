@@ -0,0 +1,58 @@
+import pandas as pd
+
+
+class Aggregate:
+    """
+    Additive summary of a dataset: a row count and, per value column, the sum and the number
+    of non-missing values (<value>_count) per key.
+    Because counts and sums are additive, aggregates can be updated with every
+    participant's rows as they are produced and merged across partitions.
+    """
+    def __init__(self, keys, values=(), where=None):
+        self.keys = list(keys)
+        self.values = list(values)
+        # optional function that takes a dataframe and returns a boolean mask of rows to count
+        self.where = where
+        self.counts = [value + "_count" for value in self.values]
+        self.df = pd.DataFrame(columns=self.keys + ["count"] + self.values + self.counts)
+
+    def update(self, df, sign=1):
+        """Adds the counts and sums of the rows in 'df', or subtracts them if 'sign' is -1."""
+        if df.shape[0] == 0 or not set(self.keys + self.values).issubset(df.columns):
+            return
+        if self.where is not None:
+            df = df[self.where(df)]
+        df = df[self.keys + self.values].assign(count=1, **{count: df[value].notna() for value, count in zip(self.values, self.counts)})
+        df = df.groupby(self.keys, dropna=False, as_index=False)[["count"] + self.values + self.counts].sum()
+        df[["count"] + self.values + self.counts] = df[["count"] + self.values + self.counts] * sign
+        self.add(df)
+
+    def merge(self, other):
+        """Adds the counts and sums of another aggregate with the same keys and values."""
+        self.add(other.df)
+
+    def add(self, df):
+        if df.shape[0] == 0:
+            return
+        combined = pd.concat([self.df, df[self.df.columns]]) if self.df.shape[0] > 0 else df[self.df.columns]
+        combined = combined.groupby(self.keys, dropna=False, as_index=False)[["count"] + self.values + self.counts].sum()
+        self.df = combined[combined["count"] != 0]
+
+    def means(self):
+        """Returns the aggregate with the sums divided by the number of non-missing values, like groupby().mean()."""
+        df = self.df.copy()
+        for value, count in zip(self.values, self.counts):
+            df[value] = df[value] / df[count].where(df[count] > 0)
+        return df
+
+    def save(self, filename):
+        self.df.to_csv(filename, index=False)
+
+    def load(self, filename):
+        # keep categories such as "NA" in behaviour_after_first_mistake, only empty keys are missing
+        self.df = pd.read_csv(filename, keep_default_na=False, na_values=[""])
+
+
+def first_correct(df):
+    """Rows where a Template x Word List combination is done without errors for the first time."""
+    return (df["times_previously_correct"].isna() | df["times_previously_correct"].eq(0)) & df["correct"].eq(1)
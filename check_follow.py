@@ -0,0 +1,110 @@
+"""
+Checks follow mode against a stand-in database (pip install -r requirements-dev.txt):
+builds the datasets from part of some generated exercises (directly, from merged shards and
+from a saved dataset), adds the remaining exercises, polls, and compares the result to a fresh construct.
+
+python check_follow.py
+"""
+import os
+import random
+import tempfile
+os.environ.setdefault("CONNECT_STR", "mongodb://localhost/progress")
+import mongoengine
+import mongomock
+from bson import ObjectId
+import pandas as pd
+from shard import datasets
+
+WORDS = ["kat", "jurk", "vis", "boom"]
+TEMPLATES = ["t2_sleep_de_letters", "bingo_v2", "t3_sleep_de_woorden", "t4_vorm_de_woorden"]
+
+
+def generate_exercise(rng, user, number):
+    """Returns an exercise document with random answers to a few words."""
+    template = rng.choice(TEMPLATES)
+    time = 1000
+    events = [{"event": "start", "time": str(time)}]
+    for word in rng.sample(WORDS, 2):
+        for position in range(len(word) if template == "t2_sleep_de_letters" else 1):
+            correct = False
+            while not correct:
+                time += rng.randint(100, 3000)
+                if rng.random() < 0.3:
+                    events.append({"event": "playAudio", "action": "play" if template == "t2_sleep_de_letters" else "playWord", "audio": word + ".mp3", "target": word, "index": position, "time": time})
+                    continue
+                correct = rng.random() < 0.6
+                answer = word[position] if template == "t2_sleep_de_letters" else word
+                events.append({"event": "drop", "action": "attempt", "parent": word, "position": position, "required": word[position],
+                               "givenAnswer": answer if correct else "x", "correct": "true" if correct else "false", "time": time})
+    if rng.random() < 0.8:
+        events.append({"event": "completed", "time": str(time + 100)})
+    events.append({"event": "close", "time": time + 500})
+    return {"_id": ObjectId(), "user": user, "path": [{"title": "DigLin"}, {"title": "NT2"}, {"title": rng.choice(["Lijst 1", "Lijst 2"])}, {"title": "v1"}],
+            "application": template, "timestamp": "2022-11-01T{:02d}:{:02d}:00.000Z".format(number // 60, number % 60), "events": events}
+
+
+def as_saved(data, directory, name):
+    """Saves and reads back a dataset and its aggregates, so datasets can be compared with equals."""
+    filename = os.path.join(directory, name + ".csv")
+    data.save(filename)
+    aggregates = [pd.read_csv(data.aggregate_filename(filename, aggregate)).round(6) for aggregate in data.aggregates]
+    return pd.read_csv(filename), aggregates
+
+
+def check(name, data, ppids, directory):
+    fresh = datasets[name]()
+    fresh.construct(ppids)
+    df, aggregates = as_saved(data, directory, name + "_followed")
+    df_fresh, aggregates_fresh = as_saved(fresh, directory, name + "_fresh")
+    assert df.equals(df_fresh), name
+    assert data.df.reset_index(drop=True).equals(fresh.df.reset_index(drop=True)), name
+    assert all(a.equals(b) for a, b in zip(aggregates, aggregates_fresh)), name
+
+
+def main():
+    mongoengine.connect(host=os.environ["CONNECT_STR"], mongo_client_class=mongomock.MongoClient)
+    db = mongoengine.get_db()
+    rng = random.Random(1)
+    exercises = {"user{}@nt2school".format(p): [generate_exercise(rng, "user{}@nt2school".format(p), n) for n in range(30)] for p in range(4)}
+    ppids = sorted(exercises)
+    with tempfile.TemporaryDirectory() as directory:
+        for name in datasets:
+            for build in ["construct", "merged shards", "loaded"]:
+                for ppid in ppids:
+                    db[ppid].drop()
+                    db[ppid].insert_many([dict(e) for e in exercises[ppid][:20]])
+                data = datasets[name]()
+                if build == "merged shards":
+                    for shard_index in range(2):
+                        datasets[name]().construct_shard(ppids, shard_index, 2, directory, name)
+                    data.merge_shards(directory, name, 2)
+                else:
+                    data.construct(ppids)
+                if build == "loaded":
+                    filename = os.path.join(directory, name + ".csv")
+                    data.save(filename)
+                    data = datasets[name]()
+                    data.load(filename)
+                    n_rows = data.df.shape[0]
+                    # without new exercises a resumed dataset stays the same
+                    assert data.poll(ppids).shape[0] == 0 and data.df.shape[0] == n_rows, name
+                    os.remove(data.aggregate_filename(filename, "manifest"))
+                    without_manifest = datasets[name]()
+                    without_manifest.load(filename)
+                    try:
+                        without_manifest.poll(ppids)
+                        raise AssertionError("polling a dataset without a manifest should fail")
+                    except ValueError:
+                        pass
+                for ppid in ppids:
+                    db[ppid].insert_many([dict(e) for e in exercises[ppid][20:]])
+                data.follow(ppids, interval=0, polls=2)
+                # polling only reads, so the new exercises were not given a _cls
+                assert all(db[ppid].count_documents({"_cls": None}) == 10 for ppid in ppids), name
+                check(name, data, ppids, directory)
+                print(name, build, "ok")
+    mongoengine.disconnect()
+
+
+if __name__ == "__main__":
+    main()
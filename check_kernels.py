@@ -0,0 +1,43 @@
+"""
+Checks that the NumPy version of the sweep in kernels.py gives exactly the same results as the loop
+(and as the Numba version if numba is installed), for random users, groups and missing values.
+
+python check_kernels.py
+"""
+import numpy as np
+import kernels
+
+
+def random_columns(rng, n_users, n_rows):
+    user = np.sort(rng.integers(0, n_users, n_rows))
+    combination = rng.integers(0, 12, n_rows)
+    template = combination // 3
+    # codes of user x template x word list and user x template, as cumulative_features makes them
+    group = np.unique(user * 12 + combination, return_inverse=True)[1]
+    template_group = np.unique(user * 4 + template, return_inverse=True)[1]
+    def with_missing(values):
+        return np.where(rng.random(n_rows) < 0.1, np.nan, values)
+    completed = with_missing(rng.integers(0, 2, n_rows).astype(float))
+    correct = with_missing(rng.integers(0, 2, n_rows).astype(float))
+    duration = with_missing(rng.random(n_rows) * 120)
+    return [a.astype(np.int64) for a in [user, group, template_group, combination]] + [completed, correct, duration]
+
+
+def main():
+    rng = np.random.default_rng(0)
+    sweeps = {"numpy": kernels._sweep_numpy}
+    if kernels._sweep_numba is not None:
+        sweeps["numba"] = kernels._sweep_numba
+    for n_users, n_rows in [(1, 0), (1, 1), (1, 5000), (3, 50), (300, 30000)]:
+        columns = random_columns(rng, n_users, n_rows)
+        for window in [0, 1, 10]:
+            expected = kernels._sweep(*columns, window)
+            for name, sweep in sweeps.items():
+                results = sweep(*columns, window)
+                for a, b in zip(expected, results):
+                    assert np.array_equal(a, b, equal_nan=True), (name, n_users, n_rows, window)
+        print(n_users, "users,", n_rows, "rows:", ", ".join(sweeps), "ok")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,4 +4,11 @@ from dotenv import load_dotenv
 load_dotenv()
 CONNECT_STR = environ["CONNECT_STR"]
 
+# optional settings for fetching data from MongoDB, see models.connect and data.DataExercise.fetch
+BATCH_SIZE = int(environ["BATCH_SIZE"]) if "BATCH_SIZE" in environ else None             # documents per cursor batch
+COMPRESSORS = environ.get("COMPRESSORS")                                                  # wire compression, e.g. zstd,snappy,zlib
+READ_PREFERENCE = environ.get("READ_PREFERENCE")                                          # e.g. secondaryPreferred
+MAX_POOL_SIZE = int(environ["MAX_POOL_SIZE"]) if "MAX_POOL_SIZE" in environ else None
+NO_CURSOR_TIMEOUT = environ.get("NO_CURSOR_TIMEOUT", "false").lower() == "true"          # for participants that take long to process
+
 col_name = "placeholder"
@@ -1,40 +1,492 @@
 import mongoengine
 import config
 import models
+import views
+from aggregates import Aggregate, first_correct
+from eventstore import EventStore
+from kernels import cumulative_features
 from importlib import reload
+from hashlib import md5
+from os import path, replace
+from time import sleep, time
+import json
 import numpy as np
 import pandas as pd
+from bson import ObjectId
+from pymongo.errors import OperationFailure
 pd.set_option('display.max_rows', None)
 pd.set_option('mode.chained_assignment', None)
 
 
+def select_shard(ppids, shard_index, shard_count):
+    """
+    Returns the participant IDs in 'ppids' that belong to shard 'shard_index'.
+    Uses a stable hash of the ID, so every process and host assigns participants to the same shard.
+    """
+    return sorted(ppid for ppid in ppids if int(md5(ppid.encode()).hexdigest(), 16) % shard_count == shard_index)
+
+
+def shard_filename(directory, name, shard_index, shard_count):
+    return path.join(directory, "{}.shard-{:03d}-of-{:03d}.csv".format(name, shard_index, shard_count))
+
+
+def column_types(df):
+    """
+    Returns the type of every column of a constructed dataset 'df': its dtype, or for columns of
+    Python objects "bools" (True/False) or "text". Text columns that have missing values get
+    " or missing". Saved with a dataset, so that read_dataset can read it back with the same types.
+    """
+    types = {}
+    for column in df.columns:
+        values = df[column]
+        if values.dtype != object:
+            kind = str(values.dtype)
+        elif values.dropna().map(lambda x: isinstance(x, (bool, np.bool_))).all():
+            kind = "bools"
+        else:
+            kind = "text"
+        if kind in ["text", "str"] and values.isna().any():
+            kind += " or missing"
+        types[column] = kind
+    return types
+
+
+def read_dataset(filename, types):
+    """
+    Reads a saved dataset with the column types 'types' (see column_types) instead of letting
+    pandas guess them, so e.g. "NA" and "TRUE" stay text. Empty values are missing, except in
+    text columns without missing values.
+    """
+    df = pd.read_csv(filename, dtype=object, keep_default_na=False)
+    for column, kind in types.items():
+        kind, _, missing = kind.partition(" or ")
+        values = df[column].replace("", np.nan) if missing or kind not in ["text", "str"] else df[column]
+        if kind in ["bools", "bool"]:
+            values = values.map({"True": True, "False": False})
+            df[column] = values.astype(bool) if kind == "bool" else values
+        elif kind == "text":
+            df[column] = values
+        else:
+            df[column] = values.astype(kind)
+    return df
+
+
 class DataExercise:
+    # aggregate views that are updated as participants are processed, see aggregates.Aggregate
+    aggregate_specs = {
+        "attempts_until_correct": {"keys": ["template", "times_previously_attempted"], "where": first_correct},
+        "behaviour_after_first_mistake": {"keys": ["template", "behaviour_after_first_mistake"]},
+        "mistakes": {"keys": ["template", "word_list"], "values": ["num_mistakes", "completed_float", "correct", "duration"]}
+    }
+
     def __init__(self):
         self.df = pd.DataFrame()
         self.regex_pattern = ".*"
+        self.aggregates = {name: Aggregate(**spec) for name, spec in self.aggregate_specs.items()}
+        # participant IDs, their number of rows and the _id of their last processed exercise, in the order in which they were added to df
+        self.collections = pd.DataFrame(columns=["collection", "rows", "last_id"])
+        # settings and results of construct_sample, None for a full build
+        self.sampling = None
+        # query settings for fetch, see config
+        self.batch_size = config.BATCH_SIZE
+        self.no_cursor_timeout = config.NO_CURSOR_TIMEOUT
+        # settings and duration of the last construct
+        self.run_info = None
+        # adds accuracy_last_<accuracy_window> to exercise_data if set, see kernels.cumulative_features
+        self.accuracy_window = None
     
+    @property
+    def df(self):
+        """The dataset. The rows that poll updated are put in place when it is first read after the poll."""
+        if len(self.updates) > 0:
+            blocks = []
+            end = 0
+            for i in sorted(self.updates):
+                # rows of the participants before i that were not updated
+                start = self.layout[i] if i < len(self.layout) - 1 else self._df.shape[0]
+                blocks += [self._df.iloc[end:start], self.updates[i]]
+                end = self.layout[i + 1] if i < len(self.layout) - 1 else self._df.shape[0]
+            self.df = pd.concat(blocks + [self._df.iloc[end:]])
+        return self._df
+
+    @df.setter
+    def df(self, df):
+        self._df = df
+        # rows of participants (by their index in collections) that poll updated, and where the rows of every participant start in _df
+        self.updates = {}
+        self.layout = None
+
     def save(self, filename):
+        """
+        Saves the dataset and writes each aggregate next to it, e.g. letter_data.letter_accuracy.csv.
+        A sampled dataset also gets its sampling settings, e.g. letter_data.sampling.json.
+        The column types (letter_data.types.json, see column_types) and the participants, their number
+        of rows and their last exercise (letter_data.manifest.csv) are saved too, so that a loaded
+        dataset can be followed.
+        """
         self.df.to_csv(filename, index=False)
+        with open(self.types_filename(filename), "w") as f:
+            json.dump(column_types(self.df), f, indent=4)
+        for name, aggregate in self.aggregates.items():
+            aggregate.save(self.aggregate_filename(filename, name))
+        if self.sampling is not None:
+            with open(self.sampling_filename(filename), "w") as f:
+                json.dump(self.sampling, f, indent=4)
+        # the manifest is written last (and atomically), so it marks the dataset as complete
+        manifest = self.aggregate_filename(filename, "manifest")
+        self.collections.to_csv(manifest + ".tmp", index=False)
+        replace(manifest + ".tmp", manifest)
+
+    def read_manifest(self, filename):
+        """Returns the participants of dataset 'filename', as saved by save."""
+        collections = pd.read_csv(self.aggregate_filename(filename, "manifest"), dtype={"collection": str})
+        collections["last_id"] = collections["last_id"].apply(lambda x: ObjectId(x) if isinstance(x, str) else None)
+        return collections
 
     def load(self, filename):
-        self.df = pd.read_csv(filename)
+        """
+        Loads a dataset saved with save, with the column types it was saved with if these were saved
+        (datasets saved without them are read by pandas as they are). Restores its participants from
+        the manifest, so that it can be followed (see follow).
+        """
+        if path.exists(self.types_filename(filename)):
+            with open(self.types_filename(filename)) as f:
+                self.df = read_dataset(filename, json.load(f))
+        else:
+            self.df = pd.read_csv(filename)
+        if path.exists(self.aggregate_filename(filename, "manifest")):
+            self.collections = self.read_manifest(filename)
+        for name, aggregate in self.aggregates.items():
+            if path.exists(self.aggregate_filename(filename, name)):
+                aggregate.load(self.aggregate_filename(filename, name))
+        if path.exists(self.sampling_filename(filename)):
+            with open(self.sampling_filename(filename)) as f:
+                self.sampling = json.load(f)
+
+    def sampling_filename(self, filename):
+        return path.splitext(filename)[0] + ".sampling.json"
+
+    def types_filename(self, filename):
+        return path.splitext(filename)[0] + ".types.json"
+
+    def load_aggregates(self, filename):
+        """Loads only the aggregates that were saved with dataset 'filename', without reading its rows."""
+        for name, aggregate in self.aggregates.items():
+            aggregate.load(self.aggregate_filename(filename, name))
+
+    def aggregate_filename(self, filename, name):
+        root, ext = path.splitext(filename)
+        return "{}.{}{}".format(root, name, ext)
+
+    def merge_aggregates(self, other):
+        """Adds the aggregates of another dataset of the same type, e.g. built from other participants."""
+        for name, aggregate in self.aggregates.items():
+            aggregate.merge(other.aggregates[name])
+
+    def update_aggregates(self, df):
+        for aggregate in self.aggregates.values():
+            aggregate.update(df)
 
-    def construct(self, ppids):
+    def update_inheritance(self, ppid):
+        """Prepares the collection of participant 'ppid' for the models in models.py (this writes to the database)."""
+        config.col_name = ppid
+        # we need to reload Exercise for each participant, because collection name changes
+        reload(models)
+        # update inheritance of collection
+        collection = models.Exercise._get_collection()
+        collection.update_many({'_cls': None}, {'$set': {'_cls': 'Exercise'}})
+
+    def fetch(self, ppid, after=None, projection=None, ids=None, last_id=None):
+        """
+        Takes a participant ID 'ppid' and returns the participant's exercises (as dictionaries) that
+        match regex_pattern ordered by timestamp, together with the highest exercise _id in the collection.
+        If 'after' is given only exercises with a higher _id are returned, if 'ids' is given only the
+        exercises with these _ids. 'last_id' saves a query if the highest _id is already known
+        (see last_ids). Only reads from the database.
+        """
+        collection = mongoengine.get_db()[ppid]
+        # exercises that are added while we process the results are left for the next fetch
+        if last_id is None:
+            last = collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+            if last is None:
+                return [], after
+            last_id = last["_id"]
+        id_range = {"$lte": last_id} if after is None else {"$gt": after, "$lte": last_id}
+        if ids is not None:
+            id_range["$in"] = list(ids)
+        # the raw documents are analyzed with the lightweight classes in views.py
+        settings = {"no_cursor_timeout": self.no_cursor_timeout}
+        if self.batch_size is not None:
+            settings["batch_size"] = self.batch_size
+        results = collection.find({"application": {"$regex": self.regex_pattern}, "_id": id_range}, projection, sort=[("timestamp", 1)], **settings)
+        return results, last_id
+
+    def last_ids(self, ppids, chunk_size=100):
+        """
+        Returns the highest exercise _id in the collection of every participant in 'ppids' (None if the
+        collection is empty). Asks for 'chunk_size' collections at once with $unionWith (MongoDB 4.4 and
+        later) and falls back to a query per collection if the server does not support it.
+        """
+        db = mongoengine.get_db()
+        last = lambda ppid: [{"$sort": {"_id": -1}}, {"$limit": 1}, {"$project": {"_id": 1, "collection": {"$literal": ppid}}}]
+        ids = {ppid: None for ppid in ppids}
+        try:
+            for i in range(0, len(ppids), chunk_size):
+                chunk = ppids[i:i + chunk_size]
+                pipeline = last(chunk[0]) + [{"$unionWith": {"coll": ppid, "pipeline": last(ppid)}} for ppid in chunk[1:]]
+                for doc in db[chunk[0]].aggregate(pipeline):
+                    ids[doc["collection"]] = doc["_id"]
+        except (OperationFailure, NotImplementedError):
+            # NotImplementedError is raised by stand-in databases such as mongomock
+            for ppid in ppids:
+                doc = db[ppid].find_one({}, {"_id": 1}, sort=[("_id", -1)])
+                ids[ppid] = doc["_id"] if doc is not None else None
+        return ids
+
+    def transfer_settings(self):
+        """Returns the settings that are used to fetch data from MongoDB."""
+        return {
+            "batch_size": self.batch_size,
+            "no_cursor_timeout": self.no_cursor_timeout,
+            "compressors": config.COMPRESSORS,
+            "read_preference": config.READ_PREFERENCE,
+            "max_pool_size": config.MAX_POOL_SIZE
+        }
+
+    def construct(self, ppids, batch_size=None, no_cursor_timeout=None):
         """
         Takes a list of participant IDs 'ppids' to construct
         the dataset from individual users' data.
+        'batch_size' and 'no_cursor_timeout' override the query settings in config.
+        """
+        if batch_size is not None:
+            self.batch_size = batch_size
+        if no_cursor_timeout is not None:
+            self.no_cursor_timeout = no_cursor_timeout
+        started = time()
+        n_rows = self.df.shape[0]
+        for ppid in ppids:
+            print(ppid)
+            self.update_inheritance(ppid)
+            results, last_id = self.fetch(ppid)
+            self.add_pp(ppid, self.process_pp(results), last_id)
+        self.run_info = {
+            "participants": len(ppids),
+            "rows": self.df.shape[0] - n_rows,
+            "seconds": time() - started,
+            "transfer": self.transfer_settings()
+        }
+        print(self.run_info)
+
+    def construct_sample(self, ppids, seed=0, n_participants=None, fraction=1, max_per_stratum=None, max_rows=None, max_seconds=None):
+        """
+        Constructs the dataset from a reproducible sample for quick exploratory runs.
+        Takes 'n_participants' random participants from 'ppids' and a 'fraction' of their exercises.
+        With 'max_per_stratum', every template x word list is sampled separately: of the sampled
+        exercises of all these participants, the 'max_per_stratum' with the lowest (seeded) hash are taken.
+        Stops once the dataset has 'max_rows' rows (the rows of the last participant are cut off
+        there) or 'max_seconds' have passed, also while the exercises are being sampled.
+        The sample is the same for the same 'seed', and the settings are stored in self.sampling
+        (and saved with the dataset). Only participants that contributed rows are listed.
+        Only reads from the database.
+        Note that user-level variables in exercise_data only count the sampled exercises.
+        """
+        started = time()
+        out_of_time = lambda: max_seconds is not None and time() - started >= max_seconds
+        rng = np.random.default_rng(seed)
+        if n_participants is not None and n_participants < len(ppids):
+            chosen = set(rng.choice(sorted(ppids), n_participants, replace=False))
+            ppids = [ppid for ppid in ppids if ppid in chosen]
+        self.sampling = {
+            "seed": seed,
+            "n_participants": n_participants,
+            "fraction": fraction,
+            "max_per_stratum": max_per_stratum,
+            "max_rows": max_rows,
+            "max_seconds": max_seconds,
+            "participants": [],
+            "exercises": 0,
+            "complete": True
+        }
+        # first pass: rank the exercises of all sampled participants per stratum, reading only a few fields
+        candidates = {}
+        last_ids = {}
+        for ppid in ppids:
+            if out_of_time():
+                self.sampling["complete"] = False
+                break
+            results, last_ids[ppid] = self.fetch(ppid, projection={"_id": 1, "application": 1, "path": 1})
+            for result in results:
+                # a stable hash of the exercise makes the selection independent of the other exercises
+                rank = int(md5("{}:{}".format(seed, result["_id"]).encode()).hexdigest(), 16) / 16 ** 32
+                if rank < fraction:
+                    candidates.setdefault(self.stratum(result), []).append((rank, ppid, result["_id"]))
+        selected = {}
+        for stratum, ranked in candidates.items():
+            for rank, ppid, _id in sorted(ranked)[:max_per_stratum]:
+                selected.setdefault(ppid, []).append(_id)
+        # second pass: fetch and process the selected exercises
+        strata = {}
+        for ppid in ppids:
+            if ppid not in selected:
+                continue
+            if (max_rows is not None and self.df.shape[0] >= max_rows) or out_of_time():
+                self.sampling["complete"] = False
+                break
+            print(ppid)
+            sample = list(self.fetch(ppid, ids=selected[ppid])[0])
+            df_pp = self.process_pp(sample)
+            if max_rows is not None and self.df.shape[0] + df_pp.shape[0] > max_rows:
+                df_pp = df_pp.iloc[:max_rows - self.df.shape[0]]
+                self.sampling["complete"] = False
+            if df_pp.shape[0] == 0:
+                continue
+            self.add_pp(ppid, df_pp, last_ids[ppid])
+            self.sampling["participants"].append(ppid)
+            # the exercises that contributed rows
+            kept = set(df_pp["exercise_id"])
+            for result in sample:
+                if str(result["_id"]) in kept:
+                    self.sampling["exercises"] += 1
+                    strata[self.stratum(result)] = strata.get(self.stratum(result), 0) + 1
+        self.sampling["strata"] = strata
+
+    @staticmethod
+    def stratum(result):
+        """Returns the template x word list of an exercise, the strata of construct_sample."""
+        return "{} x {}".format(result["application"], result["path"][2]["title"] if len(result["path"]) > 2 else "NA")
+
+    def add_pp(self, ppid, df_pp, last_id):
+        self.update_aggregates(df_pp)
+        self.df = pd.concat([self.df, df_pp])
+        self.collections.loc[self.collections.shape[0]] = [ppid, df_pp.shape[0], last_id]
+
+    def save_store(self, ppids, directory):
+        """
+        Fetches the exercises of participants 'ppids' that match regex_pattern
+        and writes them to an event store in 'directory' (see eventstore.EventStore).
+        """
+        for ppid in ppids:
+            self.update_inheritance(ppid)
+        EventStore.write(directory, ((ppid, self.fetch(ppid)[0]) for ppid in ppids))
+
+    def construct_store(self, store, ppids=None):
+        """
+        Like construct, but reads the exercises from EventStore 'store' instead of the database.
+        Takes all participants in the store if 'ppids' is not given.
         """
+        if ppids is None:
+            ppids = [c["collection"] for c in store.collections]
         for ppid in ppids:
-            config.col_name = ppid
-            print(config.col_name)
-            # we need to reload Exercise for each participant, because collection name changes
-            reload(models)
-            # update inheritance of collection
-            collection = models.Exercise._get_collection()
-            collection.update_many({'_cls': None}, {'$set': {'_cls': 'Exercise'}})
-            results = models.Exercise.objects(mongoengine.Q(application__regex=self.regex_pattern)).order_by("+timestamp")
-            df_pp = self.process_pp(results)
-            self.df = pd.concat([self.df, df_pp])
+            print(ppid)
+            results = [store.exercise(n) for n in store.exercise_indices(ppid, self.regex_pattern)]
+            last_id = next((c["last_id"] for c in store.collections if c["collection"] == ppid), None)
+            self.add_pp(ppid, self.process_pp(results), ObjectId(last_id) if last_id is not None else None)
+
+    def follow(self, ppids, interval=5, polls=None, callback=None):
+        """
+        Keeps the dataset up to date by polling the collections of participants 'ppids' for new
+        exercises every 'interval' seconds (forever, or 'polls' times). After a poll that added
+        rows, 'callback' is called with the dataset and the updated rows (see poll), e.g. to save them.
+        Usually follows a construct with the same participants; exercises that were already
+        processed are skipped. See check_follow.py for a test against a stand-in database.
+        """
+        n_polls = 0
+        while polls is None or n_polls < polls:
+            if n_polls > 0:
+                sleep(interval)
+            df_new = self.poll(ppids)
+            if callback is not None and df_new.shape[0] > 0:
+                callback(self, df_new)
+            n_polls += 1
+
+    def poll(self, ppids):
+        """
+        Processes exercises that were added to the collections of participants 'ppids'
+        since they were last fetched, and returns the updated rows of those participants.
+        Only collections with a new highest _id are queried (see last_ids), and the updated
+        rows are put in df when it is next read. Polling only reads from the database.
+        """
+        if len(self.updates) == 0:
+            if self.collections["rows"].sum() != self._df.shape[0]:
+                raise ValueError("the participants of the dataset are not known, save it with a manifest to follow it (see save)")
+            self.layout = np.concatenate([[0], np.cumsum(self.collections["rows"].to_numpy(dtype=np.int64))])
+        positions = {ppid: i for i, ppid in enumerate(self.collections["collection"])}
+        updated = []
+        for ppid, last_id in self.last_ids(ppids).items():
+            i = positions.get(ppid)
+            after = self.collections.loc[i, "last_id"] if i is not None else None
+            if last_id is None or last_id == after:
+                continue
+            results, last_id = self.fetch(ppid, after=after, last_id=last_id)
+            if i is None:
+                i = positions[ppid] = self.collections.shape[0]
+                df_old = self._df.iloc[0:0]
+            elif i in self.updates:
+                df_old = self.updates[i]
+            else:
+                df_old = self._df.iloc[self.layout[i]:self.layout[i + 1]]
+            df_pp = self.extend_pp(df_old, results)
+            self.collections.loc[i] = [ppid, df_pp.shape[0], last_id]
+            if df_pp.shape[0] == df_old.shape[0]:
+                continue
+            # remove the participant's old rows from the aggregates before adding the new ones
+            for aggregate in self.aggregates.values():
+                aggregate.update(df_old, sign=-1)
+            self.update_aggregates(df_pp)
+            self.updates[i] = df_pp
+            updated.append(df_pp)
+        return pd.concat(updated) if len(updated) > 0 else pd.DataFrame()
+
+    def extend_pp(self, df_pp, results):
+        """
+        Takes a participant's rows 'df_pp' and new exercises 'results' and returns the participant's
+        updated rows. The user-level variables are derived again, because they depend on all attempts.
+        """
+        df_raw = self.collect(results)
+        if df_raw.shape[0] == 0:
+            return df_pp
+        if df_pp.shape[0] > 0:
+            df_raw = pd.concat([df_pp[df_raw.columns], df_raw])
+        return self.derive(df_raw.reset_index(drop=True))
+
+    def construct_shard(self, ppids, shard_index, shard_count, directory, name):
+        """
+        Constructs the dataset for the participants in 'ppids' that belong to shard 'shard_index'
+        out of 'shard_count' and saves it to 'directory', so that independent workers with a
+        shared filesystem can each build one shard. Use merge_shards to combine the shards.
+        """
+        self.construct(select_shard(ppids, shard_index, shard_count))
+        filename = shard_filename(directory, name, shard_index, shard_count)
+        # save writes the manifest last, which marks the shard as complete
+        self.save(filename)
+
+    def merge_shards(self, directory, name, shard_count, ppids=None):
+        """
+        Combines the shards saved by construct_shard into one dataset. Participants are ordered
+        as in 'ppids' or alphabetically if 'ppids' is not given.
+        """
+        blocks = {}
+        for shard_index in range(shard_count):
+            filename = shard_filename(directory, name, shard_index, shard_count)
+            manifest = self.aggregate_filename(filename, "manifest")
+            if not path.exists(manifest):
+                raise FileNotFoundError("shard {} of {} is not complete: {}".format(shard_index, shard_count, manifest))
+            collections = self.read_manifest(filename)
+            shard = self.__class__()
+            shard.load_aggregates(filename)
+            self.merge_aggregates(shard)
+            if collections["rows"].sum() > 0:
+                with open(self.types_filename(filename)) as f:
+                    shard.df = read_dataset(filename, json.load(f))
+            ends = collections["rows"].cumsum()
+            for ppid, rows, end, last_id in zip(collections["collection"], collections["rows"], ends, collections["last_id"]):
+                blocks[ppid] = (shard.df.iloc[end - rows:end], last_id)
+        order = ppids if ppids is not None else sorted(blocks)
+        self.df = pd.concat([self.df] + [blocks[ppid][0] for ppid in order if ppid in blocks])
+        for ppid in order:
+            if ppid in blocks:
+                self.collections.loc[self.collections.shape[0]] = [ppid, blocks[ppid][0].shape[0], blocks[ppid][1]]
     
     def process_pp(self, results):
         """
@@ -42,6 +494,13 @@ class DataExercise:
         returns a dataframe containing variables relevant to exercise-level
         questions.
         """
+        return self.derive(self.collect(results))
+
+    def collect(self, results):
+        """
+        Takes a participant's exercises and returns a dataframe
+        with the variables that describe each attempt on its own.
+        """
         # initialize dictionary
         d = {
             "user_id": [],
@@ -59,8 +518,9 @@ class DataExercise:
         }
         # step through
         for result in results:
+            result = views.ExerciseView(result)
             # skip if eventlog is empty
-            if len([i for i in result["events"] if i["event"] != "close"]) == 0:
+            if len(result.event_indices("event", "close", equal=False)) == 0:
                 continue
             d["user_id"].append(result["user"])
             d["exercise_id"].append(result["_id"].__str__())
@@ -77,81 +537,102 @@ class DataExercise:
             d["num_mistakes"].append(n_mistakes)
             d["action_after_first_mistake"].append(action)
         # construct the initial dataframe
-        df = pd.DataFrame(d)
-        # Add some more variables based on initial variables
+        return pd.DataFrame(d)
+
+    def derive(self, df):
+        """
+        Takes a dataframe with a participant's attempts (see collect) and adds
+        the variables that depend on the user's previous and next attempts.
+        """
+        collected = list(df.columns)
         df["exercise_number"] = range(1, df.shape[0] + 1)
-        df["times_previously_attempted"] = df.groupby(["template", "word_list"]).cumcount()
         df["completed_duration"] = (df["completed_time"].astype(float) - df["start_time"].astype(float)) / 1000
         df["completed_float"] = df["completed"].astype(float)
-        df["times_previously_completed"] = df.groupby(["template", "word_list"], group_keys=False)["completed_float"].apply(lambda x : x.shift().cumsum())
         df["correct"] = df["num_mistakes"].apply(lambda x : 1.0 if x == 0 else 0.0 if x > 0 else float("nan")) * df["completed_float"]
-        df["times_previously_correct"] = df.groupby(["template", "word_list"], group_keys=False)["correct"].apply(lambda x: x.shift().cumsum())
-        df["time_previously_spent"] = df.groupby(["template", "word_list"], group_keys=False)["duration"].apply(lambda x : x.shift().cumsum())
-        df["time_previously_spent"] = df["time_previously_spent"].fillna(0)
-        df["same_as_prev"] = pd.Series([1.0]*df.shape[0]).where((df["template"] == df["template"].shift()) & (df["word_list"] == df["word_list"].shift()), 0.0)
-        df["prec_consec_attempts"] = df["same_as_prev"]
-        for i in range(1, len(df)):
-            df.loc[i, "prec_consec_attempts"] = df.loc[i, "prec_consec_attempts"] * (df.loc[i-1, "prec_consec_attempts"] + df.loc[i, "prec_consec_attempts"])
-        df["same_as_next"] = df["same_as_prev"].shift(-1)
-        # add a final variable for T2
-        df["behaviour_after_first_mistake"] = np.select(
-            condlist = [
-                df.same_as_next.eq(1.0) & df.action_after_first_mistake.eq("quit"),
-                df.same_as_next.eq(1.0) & df.action_after_first_mistake.eq("continue") & df.completed_float.eq(1.0),
-                df.same_as_next.eq(1.0) & df.action_after_first_mistake.eq("continue") & df.completed_float.eq(0.0),
-                df.same_as_next.eq(0.0) & df.action_after_first_mistake.eq("quit"),
-                df.same_as_next.eq(0.0) & df.action_after_first_mistake.eq("continue") & df.completed_float.eq(1.0),
-                df.same_as_next.eq(0.0) & df.action_after_first_mistake.eq("continue") & df.completed_float.eq(0.0)
-            ],
-            choicelist = [
-                "retry",
-                "finish & retry",
-                "continue & retry",
-                "move on",
-                "finish & move on",
-                "continue & move on"
-            ],
-            default="NA"
-        )
-        # resulting warning can be silenced with: pd.options.mode.chained_assignment = None
+        # the variables that depend on previous and next attempts are computed in one pass, see kernels.py
+        features = cumulative_features(df, window=self.accuracy_window)
+        columns = ["exercise_number", "times_previously_attempted", "completed_duration", "completed_float", "times_previously_completed",
+                   "correct", "times_previously_correct", "time_previously_spent", "same_as_prev", "prec_consec_attempts", "same_as_next",
+                   "behaviour_after_first_mistake"]
+        df = pd.concat([df, features], axis=1)
         # return the participants dataframe
-        return df
+        return df[collected + columns + [c for c in features.columns if c not in columns]]
     
 
 class Data(DataExercise):
     """Overwrites process_pp with something more generalizable."""
+    aggregate_specs = {}
+
     def __init__(self):
-        self.df = pd.DataFrame()
-        self.regex_pattern = ".*"
-        self.model_name = "Exercise"
+        super().__init__()
+        self.view_name = "ExerciseView"
     
-    def process_pp(self, results):
-        df_pp = pd.DataFrame()
+    def collect(self, results):
+        """
+        Takes a participant's exercises and returns a dataframe with a row for every response,
+        which holds the variables that process_exercise collects while stepping through the events.
+        """
+        d = {}
         for result in results:
             # create result to add template-specific methods
-            result = getattr(models, self.model_name)(**result.to_mongo())
+            result = getattr(views, self.view_name)(result)
             # process it
-            df_exercise = self.process_exercise(result)
-            df_pp = pd.concat([df_pp, df_exercise])
-        return df_pp
+            for key, values in self.process_exercise(result).items():
+                d.setdefault(key, []).extend(values)
+        return pd.DataFrame(d)
+
+    def derive(self, df):
+        """
+        Takes the rows of any number of exercises (see collect) and adds the variables that
+        depend on previous responses in the same exercise, for all exercises at once.
+        """
+        if df.shape[0] == 0:
+            return df
+        df = df.reset_index(drop=True)
+        exercises = df.groupby("exercise_id", sort=False)
+        df["num_attempts"] = df.groupby(["exercise_id", "word"], sort=False).cumcount() + 1
+        df["prev_correct"] = exercises["correct"].shift()
+        df["first_try"] = np.where(df.num_attempts.eq(1) & df.correct.eq("true"), "TRUE", "FALSE")
+        df["first_try_flt"] = np.where(df.first_try.eq("TRUE"), 1.0, 0.0)
+        df["prev_time"] = exercises["answer_time"].shift()
+        df["answer_duration"] = self.answer_duration(df, exercises)
+        return df
+
+    def answer_duration(self, df, exercises):
+        """Time since the previous answer, or since the start for the first answer in an exercise."""
+        first = exercises.cumcount().eq(0)
+        return (df["answer_time"] - df["prev_time"]).where(~first, df["answer_time"] - df["start_time"].astype(float))
+
+    def extend_pp(self, df_pp, results):
+        """Rows only depend on their own exercise, so new rows are simply appended."""
+        return pd.concat([df_pp, self.process_pp(results)])
     
-    def process_exercise(exercise):
-        return
+    def process_exercise(self, exercise):
+        """
+        Takes an exercise and returns a dictionary of lists with
+        a value for each response, see the sub-classes.
+        """
+        return {}
 
 
 class DataT2(Data):
+    aggregate_specs = {
+        "letter_accuracy": {"keys": ["correct_letter"], "values": ["first_try_flt"]},
+        "letter_confusion": {"keys": ["word_list", "correct_letter", "chosen_letter"]}
+    }
+
     def __init__(self):
-        self.df = pd.DataFrame()
+        super().__init__()
         self.regex_pattern = "t2_sleep_de_letters"
-        self.model_name = "ExerciseT2"
+        self.view_name = "ExerciseT2View"
     
     def process_exercise(self, exercise):
         """
         Takes a participant's exercise object and for each attempt at a letter
-        collects relevant variables, which are returned as a dataframe.
+        collects relevant variables, which are returned as a dictionary of lists.
         """
         if len(exercise.response_events) == 0:
-            return pd.DataFrame()
+            return {}
         # initialize dictionary
         d = {
             "user_id": [],
@@ -259,12 +740,21 @@ class DataT2(Data):
             # update relevant variables for next response
             prev_resp_i = resp[0]
             prev_wrd = wrd
-        # construct initial dataframe
-        df = pd.DataFrame(d)
-        # derive more variables from initial variables
-        df["num_attempts"] = df.groupby(["word", "position"]).cumcount() + 1
-        df["prev_correct"] = df["correct"].shift()
-        df["prev_letter_position"] = df["position"].shift()
+        # the variables that depend on previous responses are added by derive
+        return d
+
+    def derive(self, df):
+        """
+        Takes the rows of any number of T2 exercises (see collect) and adds the variables that
+        depend on previous responses in the same exercise, for all exercises at once.
+        """
+        if df.shape[0] == 0:
+            return df
+        df = df.reset_index(drop=True)
+        exercises = df.groupby("exercise_id", sort=False)
+        df["num_attempts"] = df.groupby(["exercise_id", "word", "position"], sort=False).cumcount() + 1
+        df["prev_correct"] = exercises["correct"].shift()
+        df["prev_letter_position"] = exercises["position"].shift()
         df["retry"] = np.where(df.prev_correct.eq("false") & df.prev_word.eq(df.word) & df.prev_letter_position.eq(df.position), "TRUE", "FALSE")
         df["left_to_right"] = np.select(
             condlist=[
@@ -280,27 +770,31 @@ class DataT2(Data):
         #df[["word", "position", "correct_letter", "chosen_letter", "num_attempts", "retry", "right_to_left"]]
         df["first_try"] = np.where(df.num_attempts.eq(1) & df.correct.eq("true"), "TRUE", "FALSE")
         df["first_try_flt"] = np.where(df.first_try.eq("TRUE"), 1.0, 0.0)
-        df["prev_letter"] = df["chosen_letter"].shift()
+        df["prev_letter"] = exercises["chosen_letter"].shift()
         df["same_letter_in_diff_word"] = np.where(df.prev_letter.eq(df.chosen_letter) & df.word.ne(df.prev_word), "TRUE", "FALSE")
-        df["prev_time"] = df["answer_time"].shift()
-        df["answer_duration"] = df["answer_time"] - df["prev_time"]
-        df.loc[0, "answer_duration"] = df.loc[0, "answer_time"] - float(df.loc[0, "start_time"])
-        return(df)
+        df["prev_time"] = exercises["answer_time"].shift()
+        df["answer_duration"] = self.answer_duration(df, exercises)
+        return df
     
 
 class DataT5(Data):
+    aggregate_specs = {
+        "word_accuracy": {"keys": ["word_list", "word"], "values": ["first_try_flt", "num_attempts"]},
+        "word_confusion": {"keys": ["word_list", "word", "word_answer"]}
+    }
+
     def __init__(self):
-        self.df = pd.DataFrame()
+        super().__init__()
         self.regex_pattern = "bingo_v2"
-        self.model_name = "ExerciseT5"
+        self.view_name = "ExerciseT5View"
     
     def process_exercise(self, exercise):
         """
         Takes a participant's exercise object and for each attempt at a word
-        collects relevant variables, which are returned as a dataframe.
+        collects relevant variables, which are returned as a dictionary of lists.
         """
         if len(exercise.response_events) == 0:
-            return pd.DataFrame()
+            return {}
         # initialize dictionary
         d = {
             "user_id": [],
@@ -363,32 +857,28 @@ class DataT5(Data):
             # update relevant variables for next response
             prev_resp_i = resp[0]
             prev_wrd = wrd
-        # construct initial dataframe
-        df = pd.DataFrame(d)
-        # derive more variables from initial variables
-        df["num_attempts"] = df.groupby(["word"]).cumcount() + 1
-        df["prev_correct"] = df["correct"].shift()
-        df["first_try"] = np.where(df.num_attempts.eq(1) & df.correct.eq("true"), "TRUE", "FALSE")
-        df["first_try_flt"] = np.where(df.first_try.eq("TRUE"), 1.0, 0.0)
-        df["prev_time"] = df["answer_time"].shift()
-        df["answer_duration"] = df["answer_time"] - df["prev_time"]
-        df.loc[0, "answer_duration"] = df.loc[0, "answer_time"] - float(df.loc[0, "start_time"])
-        return(df)
+        # the variables that depend on previous responses are added by derive
+        return d
     
 
 class DataT3(Data):
+    aggregate_specs = {
+        "word_accuracy": {"keys": ["word_list", "word"], "values": ["first_try_flt", "num_attempts"]},
+        "word_confusion": {"keys": ["word_list", "word", "word_answer"]}
+    }
+
     def __init__(self):
-        self.df = pd.DataFrame()
+        super().__init__()
         self.regex_pattern = "t3_sleep_de_woorden"
-        self.model_name = "ExerciseT3"
+        self.view_name = "ExerciseT3View"
     
     def process_exercise(self, exercise):
         """
         Takes a participant's exercise object and for each attempt at a word
-        collects relevant variables, which are returned as a dataframe.
+        collects relevant variables, which are returned as a dictionary of lists.
         """
         if len(exercise.response_events) == 0:
-            return pd.DataFrame()
+            return {}
         # initialize dictionary
         d = {
             "user_id": [],
@@ -477,32 +967,28 @@ class DataT3(Data):
             # update relevant variables for next response
             prev_resp_i = resp[0]
             prev_wrd = wrd
-        # construct initial dataframe
-        df = pd.DataFrame(d)
-        # derive more variables from initial variables
-        df["num_attempts"] = df.groupby(["word"]).cumcount() + 1
-        df["prev_correct"] = df["correct"].shift()
-        df["first_try"] = np.where(df.num_attempts.eq(1) & df.correct.eq("true"), "TRUE", "FALSE")
-        df["first_try_flt"] = np.where(df.first_try.eq("TRUE"), 1.0, 0.0)
-        df["prev_time"] = df["answer_time"].shift()
-        df["answer_duration"] = df["answer_time"] - df["prev_time"]
-        df.loc[0, "answer_duration"] = df.loc[0, "answer_time"] - float(df.loc[0, "start_time"])
-        return(df)
+        # the variables that depend on previous responses are added by derive
+        return d
     
 
 class DataT4(Data):
+    aggregate_specs = {
+        "word_accuracy": {"keys": ["word_list", "word"], "values": ["first_try_flt", "num_attempts"]},
+        "word_confusion": {"keys": ["word_list", "word", "word_answer"]}
+    }
+
     def __init__(self):
-        self.df = pd.DataFrame()
+        super().__init__()
         self.regex_pattern = "t4_vorm_de_woorden"
-        self.model_name = "ExerciseT4"
+        self.view_name = "ExerciseT4View"
     
     def process_exercise(self, exercise):
         """
         Takes a participant's exercise object and for each attempt at a word
-        collects relevant variables, which are returned as a dataframe.
+        collects relevant variables, which are returned as a dictionary of lists.
         """
         if len(exercise.response_events) == 0:
-            return pd.DataFrame()
+            return {}
         # initialize dictionary
         d = {
             "user_id": [],
@@ -574,14 +1060,5 @@ class DataT4(Data):
             # update relevant variables for next response
             prev_resp_i = resp[0]
             prev_wrd = wrd
-        # construct initial dataframe
-        df = pd.DataFrame(d)
-        # derive more variables from initial variables
-        df["num_attempts"] = df.groupby(["word"]).cumcount() + 1
-        df["prev_correct"] = df["correct"].shift()
-        df["first_try"] = np.where(df.num_attempts.eq(1) & df.correct.eq("true"), "TRUE", "FALSE")
-        df["first_try_flt"] = np.where(df.first_try.eq("TRUE"), 1.0, 0.0)
-        df["prev_time"] = df["answer_time"].shift()
-        df["answer_duration"] = df["answer_time"] - df["prev_time"]
-        df.loc[0, "answer_duration"] = df.loc[0, "answer_time"] - float(df.loc[0, "start_time"])
-        return(df)
\ No newline at end of file
+        # the variables that depend on previous responses are added by derive
+        return d
\ No newline at end of file
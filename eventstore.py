@@ -0,0 +1,215 @@
+import json
+import re
+from array import array
+from os import makedirs, path
+import numpy as np
+
+
+class EventStore:
+    """
+    Compact columnar copy of the exercises in the database, used as a cache for repeated builds.
+    The events of all exercises are stored back to back (CSR layout): event i of exercise n is
+    row offsets[n] + i. Every event key except time is stored as integer codes into a list of
+    distinct values (-1 if the event does not have the key), time is stored as float64.
+    The other keys of the exercises are stored as one line of JSON per exercise, and their
+    applications as codes. Everything except the list of distinct values is memory-mapped, so
+    loading the store takes hardly any time or memory, and the views in views.py read the events
+    of an exercise from the codes (see Events) without decoding them into dictionaries.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        self.fields = meta["fields"]
+        self.collections = meta["collections"]
+        with open(path.join(directory, "values.json")) as f:
+            self.values = json.load(f)
+        # plain arrays on top of the memory maps, because slicing np.memmap objects is slow
+        load = lambda name: np.asarray(np.load(path.join(directory, name), mmap_mode="r"))
+        self.offsets = load("offsets.npy")
+        self.time = load("time.npy")
+        self.codes = [load("field_{}.npy".format(k)) for k in range(len(self.fields))]
+        self.columns = dict(zip(self.fields, self.codes))
+        self.applications = load("applications.npy")
+        self.exercise_offsets = load("exercise_offsets.npy")
+        # np.memmap cannot map an empty file
+        exercises = path.join(directory, "exercises.jsonl")
+        self.exercises = np.asarray(np.memmap(exercises, dtype=np.uint8, mode="r")) if path.getsize(exercises) > 0 else np.zeros(0, dtype=np.uint8)
+        # codes of the values that were looked up and of the values that match a pattern
+        self.value_codes = None
+        self.found_codes = {}
+        self.matching = {}
+
+    def __len__(self):
+        return self.offsets.shape[0] - 1
+
+    def exercise(self, n):
+        """
+        Returns exercise 'n' as a dictionary like the documents in the database,
+        with its events as Events. Times are returned as floats.
+        """
+        exercise = json.loads(bytes(self.exercises[self.exercise_offsets[n]:self.exercise_offsets[n + 1]]))
+        exercise["events"] = Events(self, int(self.offsets[n]), int(self.offsets[n + 1]))
+        return exercise
+
+    def code(self, value):
+        """Returns the code of 'value', or -2 if no event has this value."""
+        try:
+            return self.found_codes[type(value), value]
+        except (KeyError, TypeError):
+            pass
+        if self.value_codes is None:
+            self.value_codes = {json.dumps(v, sort_keys=True): code for code, v in enumerate(self.values)}
+        code = self.value_codes.get(json.dumps(value, sort_keys=True), -2)
+        try:
+            # the type is part of the key, because e.g. 1 == True
+            self.found_codes[type(value), value] = code
+        except TypeError:
+            pass
+        return code
+
+    def exercise_indices(self, collection, pattern=None):
+        """
+        Returns the numbers of the exercises of participant 'collection',
+        or only those with an application that matches regular expression 'pattern'.
+        """
+        for c in self.collections:
+            if c["collection"] == collection:
+                indices = np.arange(c["start"], c["stop"])
+                if pattern is not None:
+                    if pattern not in self.matching:
+                        self.matching[pattern] = [code for code, v in enumerate(self.values) if isinstance(v, str) and re.search(pattern, v)]
+                    indices = indices[np.isin(self.applications[c["start"]:c["stop"]], self.matching[pattern])]
+                return indices.tolist()
+        return []
+
+    @staticmethod
+    def write(directory, participants):
+        """
+        Takes an iterable of (participant ID, exercises) pairs and writes the exercises to an
+        event store in 'directory'. Exercises can be mongoengine documents or dictionaries.
+        """
+        makedirs(directory, exist_ok=True)
+        fields = {}
+        field_codes = []
+        values = {}
+        offsets = array("q", [0])
+        times = array("d")
+        applications = array("i")
+        exercise_offsets = array("q", [0])
+        collections = []
+        with open(path.join(directory, "exercises.jsonl"), "wb") as exercises:
+            for ppid, results in participants:
+                start = len(applications)
+                last_id = None
+                for result in results:
+                    exercise = result.to_mongo().to_dict() if hasattr(result, "to_mongo") else dict(result)
+                    exercise.pop("_cls", None)
+                    events = exercise.pop("events")
+                    exercise["_id"] = str(exercise["_id"])
+                    last_id = max(last_id, exercise["_id"]) if last_id is not None else exercise["_id"]
+                    exercise_offsets.append(exercise_offsets[-1] + exercises.write(json.dumps(exercise, default=str).encode() + b"\n"))
+                    key = json.dumps(exercise.get("application"), sort_keys=True)
+                    if key not in values:
+                        values[key] = len(values)
+                    applications.append(values[key])
+                    for num_i, event in enumerate(events, len(times)):
+                        times.append(float(event["time"]) if "time" in event else float("nan"))
+                        for field, value in event.items():
+                            if field == "time":
+                                continue
+                            if field not in fields:
+                                fields[field] = len(fields)
+                                field_codes.append(array("i", [-1] * num_i))
+                            key = json.dumps(value, sort_keys=True)
+                            if key not in values:
+                                values[key] = len(values)
+                            field_codes[fields[field]].append(values[key])
+                        # events without a field get code -1
+                        for codes in field_codes:
+                            if len(codes) == num_i:
+                                codes.append(-1)
+                    offsets.append(len(times))
+                collections.append({"collection": ppid, "start": start, "stop": len(applications), "last_id": last_id})
+        np.save(path.join(directory, "offsets.npy"), np.frombuffer(offsets, dtype=np.int64))
+        np.save(path.join(directory, "time.npy"), np.frombuffer(times, dtype=np.float64))
+        for k, codes in enumerate(field_codes):
+            np.save(path.join(directory, "field_{}.npy".format(k)), np.frombuffer(codes, dtype=np.int32))
+        np.save(path.join(directory, "applications.npy"), np.frombuffer(applications, dtype=np.int32))
+        np.save(path.join(directory, "exercise_offsets.npy"), np.frombuffer(exercise_offsets, dtype=np.int64))
+        with open(path.join(directory, "values.json"), "w") as f:
+            json.dump([json.loads(key) for key in values], f)
+        # meta.json is written last, so it marks the store as complete
+        with open(path.join(directory, "meta.json"), "w") as f:
+            json.dump({"fields": list(fields), "collections": collections}, f)
+
+
+class Events:
+    """
+    The events 'start' up to 'stop' of an EventStore, e.g. of one exercise. A sequence of Event
+    that can also find events by comparing codes (see indices), so events do not have to be decoded.
+    """
+    __slots__ = ("store", "start", "stop")
+
+    def __init__(self, store, start, stop):
+        self.store = store
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError(i)
+        return Event(self.store, self.start + i)
+
+    def __iter__(self):
+        return (Event(self.store, row) for row in range(self.start, self.stop))
+
+    def indices(self, field, value=None, equal=True):
+        """Returns the indices of the events that have 'field', or where 'field' is (or is not, if 'equal' is False) 'value'."""
+        codes = self.store.columns.get(field)
+        if codes is None:
+            found = np.zeros(len(self), dtype=bool)
+        elif value is None:
+            found = codes[self.start:self.stop] >= 0
+        else:
+            found = codes[self.start:self.stop] == self.store.code(value)
+        return np.flatnonzero(found if equal else ~found).tolist()
+
+
+class Event:
+    """Row 'row' of an EventStore, read like an event dictionary. Values are decoded when they are read."""
+    __slots__ = ("store", "row")
+
+    def __init__(self, store, row):
+        self.store = store
+        self.row = row
+
+    def __getitem__(self, key):
+        if key == "time":
+            time = float(self.store.time[self.row])
+            if time != time:
+                raise KeyError(key)
+            return time
+        codes = self.store.columns.get(key)
+        code = int(codes[self.row]) if codes is not None else -1
+        if code < 0:
+            raise KeyError(key)
+        return self.store.values[code]
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
@@ -1,10 +1,10 @@
-import config
 import mongoengine
+import models
 from data import DataExercise, DataT2, DataT3, DataT4, DataT5
 import matplotlib.pyplot as plt
 
 
-connection = mongoengine.connect(host=config.CONNECT_STR)
+connection = models.connect()
 db = connection.get_database("progress")
 participants = db.list_collection_names()
 
@@ -31,6 +31,12 @@ letter_bars = letter_data.df.groupby(["correct_letter"]).sum().first_try_flt / l
 letter_bars.plot.bar()
 plt.show()
 
+# the same proportions from the aggregate that is updated during construct (and saved next to the dataset)
+letter_data.save("letter_data.csv")
+letter_accuracy = letter_data.aggregates["letter_accuracy"].means()
+letter_accuracy.plot.bar(x="correct_letter", y="first_try_flt")
+plt.show()
+
 # bingo data
 bingo_data = DataT5()
 bingo_data.construct(participants)
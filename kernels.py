@@ -0,0 +1,213 @@
+import numpy as np
+import pandas as pd
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def cumulative_features(df, window=None, use_numba=True):
+    """
+    Takes an exercise dataset (see data.DataExercise) of any number of users and returns a dataframe
+    (with the same index) with the user-level variables that depend on previous and next attempts:
+    times_previously_attempted, times_previously_completed, times_previously_correct,
+    time_previously_spent, same_as_prev, prec_consec_attempts, same_as_next and
+    behaviour_after_first_mistake. If 'window' is given, accuracy_last_<window> is added:
+    the proportion of correct attempts among the user's previous 'window' attempts at the template.
+    Rows are sorted by user and exercise_time, and all users are computed in one linear pass,
+    with Numba if it is installed (and 'use_numba' is True) or with NumPy otherwise.
+    """
+    n = df.shape[0]
+    user = pd.factorize(df["user_id"])[0]
+    order = np.lexsort((df["exercise_time"].to_numpy(dtype=str), user)) if "exercise_time" in df else np.argsort(user, kind="stable")
+    # integer codes of the user, user x template x word list and user x template of every row, in sweep order
+    group = df.groupby(["user_id", "template", "word_list"], sort=False, dropna=False).ngroup().to_numpy()[order]
+    template_group = df.groupby(["user_id", "template"], sort=False, dropna=False).ngroup().to_numpy()[order]
+    combination = df.groupby(["template", "word_list"], sort=False, dropna=False).ngroup().to_numpy()[order]
+    columns = [
+        user[order].astype(np.int64),
+        group.astype(np.int64),
+        template_group.astype(np.int64),
+        combination.astype(np.int64),
+        df["completed_float"].to_numpy(dtype=np.float64)[order],
+        df["correct"].to_numpy(dtype=np.float64)[order],
+        df["duration"].to_numpy(dtype=np.float64)[order]
+    ]
+    sweep = _sweep_numba if numba is not None and use_numba else _sweep_numpy
+    results = sweep(*columns, window if window is not None else 0)
+    names = ["times_previously_attempted", "times_previously_completed", "times_previously_correct", "time_previously_spent",
+             "same_as_prev", "prec_consec_attempts", "same_as_next", "accuracy_last_{}".format(window)]
+    out = pd.DataFrame(index=df.index)
+    for name, values in zip(names if window is not None else names[:-1], results):
+        # put the results back in the order of the rows of df
+        unsorted = np.empty(n, dtype=values.dtype)
+        unsorted[order] = values
+        out[name] = unsorted
+    out["behaviour_after_first_mistake"] = behaviour_after_first_mistake(out["same_as_next"], df["action_after_first_mistake"], df["completed_float"])
+    return out
+
+
+def behaviour_after_first_mistake(same_as_next, action_after_first_mistake, completed_float):
+    return np.select(
+        condlist = [
+            same_as_next.eq(1.0) & action_after_first_mistake.eq("quit"),
+            same_as_next.eq(1.0) & action_after_first_mistake.eq("continue") & completed_float.eq(1.0),
+            same_as_next.eq(1.0) & action_after_first_mistake.eq("continue") & completed_float.eq(0.0),
+            same_as_next.eq(0.0) & action_after_first_mistake.eq("quit"),
+            same_as_next.eq(0.0) & action_after_first_mistake.eq("continue") & completed_float.eq(1.0),
+            same_as_next.eq(0.0) & action_after_first_mistake.eq("continue") & completed_float.eq(0.0)
+        ],
+        choicelist = [
+            "retry",
+            "finish & retry",
+            "continue & retry",
+            "move on",
+            "finish & move on",
+            "continue & move on"
+        ],
+        default="NA"
+    )
+
+
+def _sweep(user, group, template_group, combination, completed, correct, duration, window):
+    """
+    Loop over rows sorted by user and time that keeps running totals per group.
+    Previous totals follow pandas' x.shift().cumsum(): missing for a group's first row
+    or if the group's previous value is missing, otherwise the sum of all previous values.
+    """
+    n = user.shape[0]
+    n_groups = group.max() + 1 if n > 0 else 0
+    n_template_groups = template_group.max() + 1 if n > 0 else 0
+    attempted = np.zeros(n, dtype=np.int64)
+    prev_completed = np.full(n, np.nan)
+    prev_correct = np.full(n, np.nan)
+    prev_spent = np.zeros(n)
+    same_as_prev = np.zeros(n)
+    prec_consec = np.zeros(n)
+    same_as_next = np.full(n, np.nan)
+    accuracy = np.full(n, np.nan)
+    count = np.zeros(n_groups, dtype=np.int64)
+    totals = np.zeros((n_groups, 3))
+    last = np.full((n_groups, 3), np.nan)
+    # ring buffers with the correct values of the last 'window' attempts per user x template
+    recent = np.full((n_template_groups, max(window, 1)), np.nan)
+    n_recent = np.zeros(n_template_groups, dtype=np.int64)
+    for i in range(n):
+        g = group[i]
+        attempted[i] = count[g]
+        if count[g] > 0:
+            if last[g, 0] == last[g, 0]:
+                prev_completed[i] = totals[g, 0]
+            if last[g, 1] == last[g, 1]:
+                prev_correct[i] = totals[g, 1]
+            if last[g, 2] == last[g, 2]:
+                prev_spent[i] = totals[g, 2]
+        values = (completed[i], correct[i], duration[i])
+        for j in range(3):
+            if values[j] == values[j]:
+                totals[g, j] += values[j]
+            last[g, j] = values[j]
+        count[g] += 1
+        if i > 0 and user[i] == user[i - 1]:
+            if combination[i] == combination[i - 1]:
+                same_as_prev[i] = 1.0
+                prec_consec[i] = prec_consec[i - 1] + 1.0
+            same_as_next[i - 1] = same_as_prev[i]
+        if window > 0:
+            t = template_group[i]
+            n_correct = 0.0
+            n_values = 0
+            for j in range(min(n_recent[t], window)):
+                if recent[t, j] == recent[t, j]:
+                    n_correct += recent[t, j]
+                    n_values += 1
+            if n_values > 0:
+                accuracy[i] = n_correct / n_values
+            recent[t, n_recent[t] % window] = correct[i]
+            n_recent[t] += 1
+    return attempted, prev_completed, prev_correct, prev_spent, same_as_prev, prec_consec, same_as_next, accuracy
+
+
+_sweep_numba = numba.njit(cache=True)(_sweep) if numba is not None else None
+
+
+def _sweep_numpy(user, group, template_group, combination, completed, correct, duration, window):
+    """
+    Version of _sweep without a Python loop over rows or groups. The running totals are cumulative
+    sums per group (see _group_cumsum), which add the values in the same order as _sweep, so the
+    results are exactly the same. See check_kernels.py.
+    """
+    n = user.shape[0]
+    by_group = np.argsort(group, kind="stable")
+    g = group[by_group]
+    first = np.ones(n, dtype=bool)
+    first[1:] = g[1:] != g[:-1]
+    position = np.arange(n)
+    start = np.maximum.accumulate(np.where(first, position, 0))
+    attempted = np.empty(n, dtype=np.int64)
+    attempted[by_group] = position - start
+    previous = []
+    for values in [completed, correct, duration]:
+        x = values[by_group]
+        # sums of all values up to each row, restarted for every group
+        sums = _group_cumsum(np.nan_to_num(x), position - start, start)
+        prev = np.concatenate([[np.nan], sums[:-1]])[:n]
+        prev_x = np.concatenate([[np.nan], x[:-1]])[:n]
+        prev[first | np.isnan(prev_x)] = np.nan
+        unsorted = np.empty(n)
+        unsorted[by_group] = prev
+        previous.append(unsorted)
+    prev_completed, prev_correct, prev_spent = previous
+    prev_spent = np.nan_to_num(prev_spent, nan=0.0)
+    # consecutive attempts at the same template x word list by the same user
+    same_user = np.zeros(n, dtype=bool)
+    same_user[1:] = user[1:] == user[:-1]
+    same_as_prev = np.zeros(n)
+    same_as_prev[1:] = (same_user[1:] & (combination[1:] == combination[:-1])).astype(float)
+    last_change = np.maximum.accumulate(np.where(same_as_prev == 0, position, 0))
+    prec_consec = (position - last_change).astype(float)
+    same_as_next = np.full(n, np.nan)
+    same_as_next[:-1] = np.where(same_user[1:], same_as_prev[1:], np.nan)
+    accuracy = np.full(n, np.nan)
+    if window > 0:
+        by_template = np.argsort(template_group, kind="stable")
+        t = template_group[by_template]
+        first = np.ones(n, dtype=bool)
+        first[1:] = t[1:] != t[:-1]
+        start = np.maximum.accumulate(np.where(first, position, 0))
+        x = correct[by_template]
+        sums = np.concatenate([[0.0], np.cumsum(np.nan_to_num(x))])
+        counts = np.concatenate([[0], np.cumsum(~np.isnan(x))])
+        lower = np.maximum(start, position - window)
+        n_values = counts[position] - counts[lower]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            acc = np.where(n_values > 0, (sums[position] - sums[lower]) / n_values, np.nan)
+        accuracy[by_template] = acc
+    return attempted, prev_completed, prev_correct, prev_spent, same_as_prev, prec_consec, same_as_next, accuracy
+
+
+def _group_cumsum(x, position, start):
+    """
+    Cumulative sums of 'x' (rows sorted by group) that restart at the first row of every group,
+    given the position of each row in its group and the row where its group starts. The values are
+    added one after another like in a loop (np.cumsum along the rows of a matrix with a group per row),
+    so the sums do not depend on other groups. Groups are put in a matrix per power-of-two length,
+    so the matrices take at most twice the memory of 'x'.
+    """
+    n = x.shape[0]
+    last = np.ones(n, dtype=bool)
+    last[:-1] = start[1:] != start[:-1]
+    # length of the group of every row
+    length = np.zeros(n, dtype=np.int64)
+    length[start[last]] = position[last] + 1
+    length = length[start]
+    width = np.ones(n, dtype=np.int64) << np.ceil(np.log2(length)).astype(np.int64)
+    sums = np.empty(n)
+    for w in np.unique(width):
+        rows = np.flatnonzero(width == w)
+        # number of the group of each row among the groups of this width
+        group = np.cumsum(position[rows] == 0) - 1
+        matrix = np.zeros((group[-1] + 1, w))
+        matrix[group, position[rows]] = x[rows]
+        sums[rows] = np.cumsum(matrix, axis=1)[group, position[rows]]
+    return sums
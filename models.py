@@ -1,5 +1,23 @@
 import mongoengine
 import config
+import views
+from pymongo.read_preferences import make_read_preference, read_pref_mode_from_name
+
+
+def connect(host=None, compressors=None, read_preference=None, max_pool_size=None):
+    """
+    Connects to MongoDB with the transfer settings in config, unless they are overridden.
+    The settings that are used are stored in config, so they can be reported with the datasets.
+    """
+    config.COMPRESSORS = compressors if compressors is not None else config.COMPRESSORS
+    config.READ_PREFERENCE = read_preference if read_preference is not None else config.READ_PREFERENCE
+    config.MAX_POOL_SIZE = max_pool_size if max_pool_size is not None else config.MAX_POOL_SIZE
+    settings = {"compressors": config.COMPRESSORS, "maxPoolSize": config.MAX_POOL_SIZE}
+    if config.READ_PREFERENCE is not None:
+        # mongoengine sets the read preference itself, so it needs a read preference object
+        settings["read_preference"] = make_read_preference(read_pref_mode_from_name(config.READ_PREFERENCE), None)
+    return mongoengine.connect(host=host if host is not None else config.CONNECT_STR, **{k: v for k, v in settings.items() if v is not None})
+
 
 class Exercise(mongoengine.Document):
     meta = {'collection': config.col_name, 'allow_inheritance': True}
@@ -15,36 +33,12 @@ class Exercise(mongoengine.Document):
     timestamp = mongoengine.StringField()
     events = mongoengine.ListField()
     
-    # some methods do not not apply to t1
-    def return_complete(self):
-        if self.application == "t1_de_woorden":
-            return float("nan"), float("nan")
-        completed = "completed" in [i["event"] for i in self.events]
-        if not completed:
-            return False, float("nan")
-        return True, [i for i in self.events if i["event"] == "completed"][0]["time"]
-
-    def return_mistakes(self):
-        if self.application == "t1_de_woorden":
-            return float("nan"), "NA"
-        self.attempts = [i["correct"] for i in self.events if "givenAnswer" in i]
-        self.n_mistakes = sum([int(i=='false') for i in self.attempts])
-        self.first_mistake_i = float("nan") if "false" not in self.attempts else self.attempts.index("false")
-        self.action = "quit" if self.first_mistake_i + 1 == len(self.attempts) else "continue" if self.first_mistake_i + 1 < len(self.attempts) else "NA"
-        return self.n_mistakes, self.action
-
-    def return_duration(self):
-        return float([i for i in self.events if i["event"] != "close"][-1]["time"]) / 1000
-    
-    def get_start(self):
-        "Return when the start button was clicked."
-        if len([i for i in self.events if i["event"] == "start"]) > 0:
-            return [i for i in self.events if i["event"] == "start"][0]["time"]
-        # mainly for T6 Luister en Typ which doesn't have start logs
-        actions = [i for i in self.events if "action" in i]
-        if len([a for a in actions if a["action"] == "attempt"]) > 0:
-            return [a for a in actions if a["action"] == "attempt"][0]["time"]
-        return "nan"
+    # the analysis methods are shared with the lightweight views in views.py
+    event_indices = views.ExerciseView.event_indices
+    return_complete = views.ExerciseView.return_complete
+    return_mistakes = views.ExerciseView.return_mistakes
+    return_duration = views.ExerciseView.return_duration
+    get_start = views.ExerciseView.get_start
 
 
 class ExerciseT2(Exercise):
@@ -52,91 +46,22 @@ class ExerciseT2(Exercise):
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # get response events while keeping track of original index
-        self.action_events = [(num_i, i) for num_i, i in enumerate(self.events, 0) if "action" in i]
-        self.response_events = [i for i in self.action_events if i[1]["action"] == "attempt"]
-        # get audio events for later use
-        self.audio_events = {str(num_i): i for num_i, i in enumerate(self.events, 0) if i["event"] == "playAudio"}
-        # get picture events for later use
-        self.picture_events = {str(num_i): i for num_i, i in enumerate(self.events, 0) if i["event"] == "showImage"}
-        self.picture_ends = {i["uuid"]: float(i["time"]) for i in self.events if i["event"] == "hideImage" and i["uuid"] != ""}
+        self.index_events()
+
+    index_events = views.ExerciseT2View.index_events
+    get_audio = views.ExerciseT2View.get_audio
+    get_pictures = views.ExerciseT2View.get_pictures
 
-    def get_audio(self, first_sound_times, first_word_times, prev_resp_i, resp_n):
-        """look back for audio events between previous resp and current resp"""
-        resp = self.response_events[resp_n]
-        wrd = resp[1]["parent"]
-        pos = resp[1]["position"]
-        words_betw_answers = []
-        sounds_betw_answers = []
-        n_word_betw_answers = 0
-        n_sound_betw_answers = 0
-        played_audio_indices = [int(i) for i in self.audio_events if int(i) > prev_resp_i and int(i) < resp[0]]
-        for audio_i in played_audio_indices:
-            audio_event = self.events[audio_i]
-            if audio_event["action"] == "play":             # if a word is played
-                wrd_label = audio_event["audio"].split(".")[0]
-                words_betw_answers.append(wrd_label)
-                n_word_betw_answers += 1 if wrd_label == wrd else 0
-                if wrd_label not in first_word_times:
-                    first_word_times[wrd_label] = float(audio_event["time"])
-            else:                                           # if a sound is played
-                # get index of the sound and the word the sound belongs to
-                sound_tpl = (audio_event["index"], audio_event["target"])
-                sounds_betw_answers.append(str(sound_tpl))
-                n_sound_betw_answers += 1 if sound_tpl[1] == wrd and sound_tpl[0] == pos else 0
-                if str(sound_tpl) not in first_sound_times:
-                    first_sound_times[str(sound_tpl)] = float(audio_event["time"])
-        return first_sound_times, first_word_times, words_betw_answers, sounds_betw_answers, n_word_betw_answers, n_sound_betw_answers
-    
-    def get_pictures(self, first_pic_times, prev_resp_i, resp_n):
-        """look back for picture events between previous resp and current resp"""
-        resp = self.response_events[resp_n]
-        wrd = resp[1]["parent"]
-        pics_betw_answers = []
-        dur_pic_betw_answers = 0
-        shown_picture_indices = [int(i) for i in self.picture_events if int(i) > prev_resp_i and int(i) < resp[0]]
-        for pic_i in shown_picture_indices:
-            pic_event = self.events[pic_i]
-            pic_label = pic_event["target"]
-            pics_betw_answers.append(pic_label)
-            if pic_event["uuid"] in self.picture_ends:
-                pic_end = min(self.picture_ends[pic_event["uuid"]], float(resp[1]["time"]))             # make sure we use end time before response
-            else:
-                pic_end = float("nan")
-            pic_dur = pic_end - float(pic_event["time"])
-            dur_pic_betw_answers += pic_dur if pic_label == wrd else 0
-            if pic_label not in first_pic_times:
-                first_pic_times[pic_label] = float(pic_event["time"])
-        return first_pic_times, pics_betw_answers, dur_pic_betw_answers
-    
 
 class ExerciseT5(Exercise):
     """Sub-class of Exercise that adds methods for analyzing Template 5 (bingo) data."""
     
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        # get response events while keeping track of original index
-        self.action_events = [(num_i, i) for num_i, i in enumerate(self.events, 0) if "action" in i]
-        self.response_events = [i for i in self.action_events if i[1]["action"] == "attempt"]
-        # get audio events for later use
-        self.audio_events = {str(num_i): i for num_i, i in enumerate(self.events, 0) if i["event"] == "playAudio"}
-    
-    def get_audio(self, first_word_times, prev_resp_i, resp_n):
-        """look back for audio events between previous resp and current resp"""
-        resp = self.response_events[resp_n]
-        wrd = resp[1]["parent"]
-        words_betw_answers = []
-        n_word_betw_answers = 0
-        played_audio_indices = [int(i) for i in self.audio_events if int(i) > prev_resp_i and int(i) < resp[0]]
-        for audio_i in played_audio_indices:
-            audio_event = self.events[audio_i]
-            wrd_label = audio_event["target"]
-            words_betw_answers.append(wrd_label)
-            n_word_betw_answers += 1 if wrd_label == wrd else 0
-            if wrd_label not in first_word_times:
-                first_word_times[wrd_label] = float(audio_event["time"])
+        self.index_events()
 
-        return first_word_times, words_betw_answers, n_word_betw_answers
+    index_events = views.ExerciseT5View.index_events
+    get_audio = views.ExerciseT5View.get_audio
 
 
 class ExerciseT3(ExerciseT2):
@@ -144,68 +69,12 @@ class ExerciseT3(ExerciseT2):
     Sub-class of Exercise that adds methods for analyzing Template 3 (drag the words) data.
     It inherits from ExerciseT2 and overwrites its get_audio method.
     """
-    
-    def get_audio(self, first_word_times, prev_resp_i, resp_n):
-        """look back for audio events between previous resp and current resp"""
-        resp = self.response_events[resp_n]
-        wrd = resp[1]["parent"]
-        words_betw_answers = []
-        sounds_betw_answers = []
-        n_word_betw_answers = 0
-        played_audio_indices = [int(i) for i in self.audio_events if int(i) > prev_resp_i and int(i) < resp[0]]
-        for audio_i in played_audio_indices:
-            audio_event = self.events[audio_i]
-            if audio_event["action"] == "playWord":             # if a word is played
-                wrd_label = audio_event["audio"].split(".")[0]
-                words_betw_answers.append(wrd_label)
-                n_word_betw_answers += 1 if wrd_label == wrd else 0
-                if wrd_label not in first_word_times:
-                    first_word_times[wrd_label] = float(audio_event["time"])
-            else:                                           # if a sound from the soundbar is played
-                assert audio_event["action"] == "soundbarSound"
-                # get index of the sound and the word the sound belongs to
-                # get sound label
-                sound_lab = audio_event["audio"]
-                sounds_betw_answers.append(str(sound_lab))
-        
-        return first_word_times, words_betw_answers, sounds_betw_answers, n_word_betw_answers
-    
+    get_audio = views.ExerciseT3View.get_audio
+
 
 class ExerciseT4(ExerciseT2):
     """
     Sub-class of Exercise that adds methods for analyzing Template 4 (form the words) data.
     It inherits from ExerciseT2 and overwrites its get_audio method.
     """
-        
-    def get_audio(self, first_sound_times, prev_resp_i, resp_n):
-        """look back for audio events between previous resp and current resp"""
-        resp = self.response_events[resp_n]
-        wrd = resp[1]["parent"]
-        words_betw_answers = []
-        sounds_betw_answers = []
-        sb_sounds_betw_answers = []
-        audio_betw_answers = []
-        n_sound_betw_answers = 0
-        n_sb_sound_betw_answers = 0
-        played_audio_indices = [int(i) for i in self.audio_events if int(i) > prev_resp_i and int(i) < resp[0]]
-        for audio_i in played_audio_indices:
-            audio_event = self.events[audio_i]
-            if audio_event["action"] == "playWord":             # if a word is played
-                wrd_label = audio_event["audio"].split(".")[0]
-                words_betw_answers.append(wrd_label)
-                audio_betw_answers.append(wrd_label)
-            elif audio_event["action"] == "character_sound":         # if a sound is played
-                # get index of the sound and the word the sound belongs to
-                sound_tpl = (audio_event["index"], audio_event["target"])
-                sounds_betw_answers.append(str(sound_tpl))
-                audio_betw_answers.append(str(sound_tpl))
-                n_sound_betw_answers += 1 if sound_tpl[1] == wrd else 0
-                if str(sound_tpl) not in first_sound_times:
-                    first_sound_times[str(sound_tpl)] = float(audio_event["time"])
-            else:                                                       # if a soundbarSound is played
-                sb_sound_tpl = (audio_event["audio"], "soundbar")
-                sb_sounds_betw_answers.append(str(sb_sound_tpl))
-                audio_betw_answers.append(str(sb_sound_tpl))
-                n_sb_sound_betw_answers += 1
-        
-        return first_sound_times, audio_betw_answers, n_sound_betw_answers
\ No newline at end of file
+    get_audio = views.ExerciseT4View.get_audio
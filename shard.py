@@ -0,0 +1,53 @@
+"""
+Builds the datasets in shards on several machines that share a filesystem, e.g.:
+
+python shard.py build 0 4 /shared/diglin      # on every worker, with shard indices 0 to 3
+python shard.py merge 4 /shared/diglin .      # once all workers are done
+"""
+import argparse
+import mongoengine
+import models
+from data import DataExercise, DataT2, DataT3, DataT4, DataT5
+
+datasets = {
+    "exercise_data": DataExercise,
+    "letter_data": DataT2,
+    "bingo_data": DataT5,
+    "drag_words_data": DataT3,
+    "form_words_data": DataT4
+}
+
+
+def build(args):
+    connection = models.connect()
+    participants = connection.get_database("progress").list_collection_names()
+    for name in args.datasets:
+        datasets[name]().construct_shard(participants, args.shard_index, args.shard_count, args.directory, name)
+    mongoengine.disconnect()
+
+
+def merge(args):
+    for name in args.datasets:
+        data = datasets[name]()
+        data.merge_shards(args.directory, name, args.shard_count)
+        data.save("{}/{}.csv".format(args.output, name))
+
+
+parser = argparse.ArgumentParser(description="Build DigLin+ datasets in shards and merge them.")
+subparsers = parser.add_subparsers(required=True)
+build_parser = subparsers.add_parser("build", help="construct one shard of the datasets")
+build_parser.add_argument("shard_index", type=int)
+build_parser.add_argument("shard_count", type=int)
+build_parser.add_argument("directory", help="shared directory for the shards")
+build_parser.set_defaults(func=build)
+merge_parser = subparsers.add_parser("merge", help="combine all shards into the final datasets")
+merge_parser.add_argument("shard_count", type=int)
+merge_parser.add_argument("directory", help="shared directory with the shards")
+merge_parser.add_argument("output", help="directory for the merged datasets")
+merge_parser.set_defaults(func=merge)
+for subparser in [build_parser, merge_parser]:
+    subparser.add_argument("--datasets", nargs="+", choices=list(datasets), default=list(datasets))
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,232 @@
+from eventstore import Events
+
+
+class ExerciseView:
+    """
+    Lightweight wrapper around an exercise document (a dictionary, e.g. from a pymongo query or
+    eventstore.EventStore.exercise) with the analysis methods of models.Exercise. The events of
+    an exercise in an event store are a row range of the store, which are found by their codes.
+    """
+    __slots__ = ("doc", "events")
+
+    def __init__(self, doc):
+        self.doc = doc
+        self.events = doc["events"]
+
+    def __getitem__(self, key):
+        return self.doc[key]
+
+    def event_indices(self, field, value=None, equal=True):
+        """Returns the indices of the events that have 'field', or where 'field' is (or is not, if 'equal' is False) 'value'."""
+        if isinstance(self.events, Events):
+            return self.events.indices(field, value, equal)
+        if value is None:
+            return [num_i for num_i, i in enumerate(self.events) if (field in i) == equal]
+        return [num_i for num_i, i in enumerate(self.events) if (i.get(field) == value) == equal]
+
+    # some methods do not not apply to t1
+    def return_complete(self):
+        if self["application"] == "t1_de_woorden":
+            return float("nan"), float("nan")
+        completed = self.event_indices("event", "completed")
+        if len(completed) == 0:
+            return False, float("nan")
+        return True, self.events[completed[0]]["time"]
+
+    def return_mistakes(self):
+        if self["application"] == "t1_de_woorden":
+            return float("nan"), "NA"
+        attempts = [self.events[num_i]["correct"] for num_i in self.event_indices("givenAnswer")]
+        n_mistakes = sum([int(i=='false') for i in attempts])
+        first_mistake_i = float("nan") if "false" not in attempts else attempts.index("false")
+        action = "quit" if first_mistake_i + 1 == len(attempts) else "continue" if first_mistake_i + 1 < len(attempts) else "NA"
+        return n_mistakes, action
+
+    def return_duration(self):
+        return float(self.events[self.event_indices("event", "close", equal=False)[-1]]["time"]) / 1000
+    
+    def get_start(self):
+        "Return when the start button was clicked."
+        starts = self.event_indices("event", "start")
+        if len(starts) > 0:
+            return self.events[starts[0]]["time"]
+        # mainly for T6 Luister en Typ which doesn't have start logs
+        attempts = self.event_indices("action", "attempt")
+        if len(attempts) > 0:
+            return self.events[attempts[0]]["time"]
+        return "nan"
+
+
+class ExerciseT2View(ExerciseView):
+    """Sub-class of ExerciseView that adds methods for analyzing Template 2 data."""
+    __slots__ = ("action_events", "response_events", "audio_events", "picture_events", "picture_ends")
+
+    def __init__(self, doc):
+        super().__init__(doc)
+        self.index_events()
+
+    def index_events(self):
+        # get response events while keeping track of original index
+        self.action_events = [(num_i, self.events[num_i]) for num_i in self.event_indices("action")]
+        self.response_events = [(num_i, self.events[num_i]) for num_i in self.event_indices("action", "attempt")]
+        # get audio events for later use
+        self.audio_events = {str(num_i): self.events[num_i] for num_i in self.event_indices("event", "playAudio")}
+        # get picture events for later use
+        self.picture_events = {str(num_i): self.events[num_i] for num_i in self.event_indices("event", "showImage")}
+        hidden = [self.events[num_i] for num_i in self.event_indices("event", "hideImage")]
+        self.picture_ends = {i["uuid"]: float(i["time"]) for i in hidden if i["uuid"] != ""}
+
+    def get_audio(self, first_sound_times, first_word_times, prev_resp_i, resp_n):
+        """look back for audio events between previous resp and current resp"""
+        resp = self.response_events[resp_n]
+        wrd = resp[1]["parent"]
+        pos = resp[1]["position"]
+        words_betw_answers = []
+        sounds_betw_answers = []
+        n_word_betw_answers = 0
+        n_sound_betw_answers = 0
+        played_audio_indices = [int(i) for i in self.audio_events if int(i) > prev_resp_i and int(i) < resp[0]]
+        for audio_i in played_audio_indices:
+            audio_event = self.events[audio_i]
+            if audio_event["action"] == "play":             # if a word is played
+                wrd_label = audio_event["audio"].split(".")[0]
+                words_betw_answers.append(wrd_label)
+                n_word_betw_answers += 1 if wrd_label == wrd else 0
+                if wrd_label not in first_word_times:
+                    first_word_times[wrd_label] = float(audio_event["time"])
+            else:                                           # if a sound is played
+                # get index of the sound and the word the sound belongs to
+                sound_tpl = (audio_event["index"], audio_event["target"])
+                sounds_betw_answers.append(str(sound_tpl))
+                n_sound_betw_answers += 1 if sound_tpl[1] == wrd and sound_tpl[0] == pos else 0
+                if str(sound_tpl) not in first_sound_times:
+                    first_sound_times[str(sound_tpl)] = float(audio_event["time"])
+        return first_sound_times, first_word_times, words_betw_answers, sounds_betw_answers, n_word_betw_answers, n_sound_betw_answers
+    
+    def get_pictures(self, first_pic_times, prev_resp_i, resp_n):
+        """look back for picture events between previous resp and current resp"""
+        resp = self.response_events[resp_n]
+        wrd = resp[1]["parent"]
+        pics_betw_answers = []
+        dur_pic_betw_answers = 0
+        shown_picture_indices = [int(i) for i in self.picture_events if int(i) > prev_resp_i and int(i) < resp[0]]
+        for pic_i in shown_picture_indices:
+            pic_event = self.events[pic_i]
+            pic_label = pic_event["target"]
+            pics_betw_answers.append(pic_label)
+            if pic_event["uuid"] in self.picture_ends:
+                pic_end = min(self.picture_ends[pic_event["uuid"]], float(resp[1]["time"]))             # make sure we use end time before response
+            else:
+                pic_end = float("nan")
+            pic_dur = pic_end - float(pic_event["time"])
+            dur_pic_betw_answers += pic_dur if pic_label == wrd else 0
+            if pic_label not in first_pic_times:
+                first_pic_times[pic_label] = float(pic_event["time"])
+        return first_pic_times, pics_betw_answers, dur_pic_betw_answers
+    
+
+class ExerciseT5View(ExerciseView):
+    """Sub-class of ExerciseView that adds methods for analyzing Template 5 (bingo) data."""
+    __slots__ = ("action_events", "response_events", "audio_events")
+
+    def __init__(self, doc):
+        super().__init__(doc)
+        self.index_events()
+
+    def index_events(self):
+        # get response events while keeping track of original index
+        self.action_events = [(num_i, self.events[num_i]) for num_i in self.event_indices("action")]
+        self.response_events = [(num_i, self.events[num_i]) for num_i in self.event_indices("action", "attempt")]
+        # get audio events for later use
+        self.audio_events = {str(num_i): self.events[num_i] for num_i in self.event_indices("event", "playAudio")}
+    
+    def get_audio(self, first_word_times, prev_resp_i, resp_n):
+        """look back for audio events between previous resp and current resp"""
+        resp = self.response_events[resp_n]
+        wrd = resp[1]["parent"]
+        words_betw_answers = []
+        n_word_betw_answers = 0
+        played_audio_indices = [int(i) for i in self.audio_events if int(i) > prev_resp_i and int(i) < resp[0]]
+        for audio_i in played_audio_indices:
+            audio_event = self.events[audio_i]
+            wrd_label = audio_event["target"]
+            words_betw_answers.append(wrd_label)
+            n_word_betw_answers += 1 if wrd_label == wrd else 0
+            if wrd_label not in first_word_times:
+                first_word_times[wrd_label] = float(audio_event["time"])
+
+        return first_word_times, words_betw_answers, n_word_betw_answers
+
+
+class ExerciseT3View(ExerciseT2View):
+    """
+    Sub-class of ExerciseView that adds methods for analyzing Template 3 (drag the words) data.
+    It inherits from ExerciseT2View and overwrites its get_audio method.
+    """
+    __slots__ = ()
+    
+    def get_audio(self, first_word_times, prev_resp_i, resp_n):
+        """look back for audio events between previous resp and current resp"""
+        resp = self.response_events[resp_n]
+        wrd = resp[1]["parent"]
+        words_betw_answers = []
+        sounds_betw_answers = []
+        n_word_betw_answers = 0
+        played_audio_indices = [int(i) for i in self.audio_events if int(i) > prev_resp_i and int(i) < resp[0]]
+        for audio_i in played_audio_indices:
+            audio_event = self.events[audio_i]
+            if audio_event["action"] == "playWord":             # if a word is played
+                wrd_label = audio_event["audio"].split(".")[0]
+                words_betw_answers.append(wrd_label)
+                n_word_betw_answers += 1 if wrd_label == wrd else 0
+                if wrd_label not in first_word_times:
+                    first_word_times[wrd_label] = float(audio_event["time"])
+            else:                                           # if a sound from the soundbar is played
+                assert audio_event["action"] == "soundbarSound"
+                # get index of the sound and the word the sound belongs to
+                # get sound label
+                sound_lab = audio_event["audio"]
+                sounds_betw_answers.append(str(sound_lab))
+        
+        return first_word_times, words_betw_answers, sounds_betw_answers, n_word_betw_answers
+    
+
+class ExerciseT4View(ExerciseT2View):
+    """
+    Sub-class of ExerciseView that adds methods for analyzing Template 4 (form the words) data.
+    It inherits from ExerciseT2View and overwrites its get_audio method.
+    """
+    __slots__ = ()
+        
+    def get_audio(self, first_sound_times, prev_resp_i, resp_n):
+        """look back for audio events between previous resp and current resp"""
+        resp = self.response_events[resp_n]
+        wrd = resp[1]["parent"]
+        words_betw_answers = []
+        sounds_betw_answers = []
+        sb_sounds_betw_answers = []
+        audio_betw_answers = []
+        n_sound_betw_answers = 0
+        n_sb_sound_betw_answers = 0
+        played_audio_indices = [int(i) for i in self.audio_events if int(i) > prev_resp_i and int(i) < resp[0]]
+        for audio_i in played_audio_indices:
+            audio_event = self.events[audio_i]
+            if audio_event["action"] == "playWord":             # if a word is played
+                wrd_label = audio_event["audio"].split(".")[0]
+                words_betw_answers.append(wrd_label)
+                audio_betw_answers.append(wrd_label)
+            elif audio_event["action"] == "character_sound":         # if a sound is played
+                # get index of the sound and the word the sound belongs to
+                sound_tpl = (audio_event["index"], audio_event["target"])
+                sounds_betw_answers.append(str(sound_tpl))
+                audio_betw_answers.append(str(sound_tpl))
+                n_sound_betw_answers += 1 if sound_tpl[1] == wrd else 0
+                if str(sound_tpl) not in first_sound_times:
+                    first_sound_times[str(sound_tpl)] = float(audio_event["time"])
+            else:                                                       # if a soundbarSound is played
+                sb_sound_tpl = (audio_event["audio"], "soundbar")
+                sb_sounds_betw_answers.append(str(sb_sound_tpl))
+                audio_betw_answers.append(str(sb_sound_tpl))
+                n_sb_sound_betw_answers += 1
+        
+        return first_sound_times, audio_betw_answers, n_sound_betw_answers
\ No newline at end of file